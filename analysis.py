@@ -4,15 +4,25 @@ Module d'analyse pour le projet Green Optimizer.
 Fonction principale : run_analysis(url) → dict
 """
 
+import re
 import time
-from typing import Dict, Any, List
+from collections import defaultdict
+from typing import Dict, Any, List, Optional
 from urllib.parse import urljoin
 
-def _detect_unused_images(page, network_events: List[Dict[str, Any]], images: List[Dict[str, Any]], base_url: str) -> List[str]:
+# noms de fichiers .css référencés dans le texte d'une feuille (@import, sourceMappingURL, ...)
+_CSS_NAME_RE = re.compile(r"([\w.\-]+\.css)\b")
+# url(...) dans le texte d'une feuille CSS
+_CSS_URL_RE = re.compile(r"""url\(\s*['"]?(.*?)['"]?\s*\)""")
+# écart de taille toléré entre une feuille CSS et sa réponse réseau
+_CSS_SIZE_TOLERANCE = 20
+
+def _detect_unused_images(network_events: List[Dict[str, Any]], images: List[Dict[str, Any]], bg_urls: List[str], base_url: str) -> List[str]:
     """
     Return list of image URLs that were loaded (network events) but not used in DOM <img>
     nor referenced as CSS background-images. Also include DOM images with zero natural size.
     Heuristic: compare absolute URLs.
+    bg_urls are the absolute CSS background-image URLs collected by _collect_dom_assets.
     """
     try:
         net_images = set(
@@ -30,42 +40,140 @@ def _detect_unused_images(page, network_events: List[Dict[str, Any]], images: Li
                 if (not img.get("width") or not img.get("height")):
                     zero_dom.add(abs_src)
 
-        # collect CSS background-image URLs (absolute) in page
-        try:
-            bg_urls = page.evaluate(
-                """() => {
-                    const urls = new Set();
-                    for (const el of document.querySelectorAll('*')) {
+        used = dom_abs.union(bg_urls)
+        dead = net_images - used
+
+        # include DOM zero-size images that were requested
+        dead |= zero_dom & net_images
+
+        return sorted(dead)
+    except Exception:
+        return []
+
+def _collect_dom_assets(page) -> Dict[str, Any]:
+    """
+    Single evaluate (one CDP round-trip) returning
+    {"images": [...], "bgUrls": [...], "unreadableSheets": [...]}:
+    the <img> elements with their natural size, the absolute URLs referenced as
+    background images and the hrefs of cross-origin sheets whose rules cannot be read.
+    Background URLs come from the stylesheet rules (O(rules)) plus inline
+    style="background..." attributes, instead of a getComputedStyle call on every node.
+    """
+    return page.evaluate(
+        """() => {
+            // collection live : pas de snapshot NodeList comme avec querySelectorAll
+            const images = [];
+            for (const el of document.getElementsByTagName('img')) {
+                images.push({
+                    src: el.getAttribute('src'),
+                    absolute_src: el.src || null,
+                    width: el.naturalWidth,
+                    height: el.naturalHeight,
+                });
+            }
+            const urls = new Set();
+            // match all url(...) occurrences ; compilée une seule fois
+            const re = /url\\((?:'|")?(.*?)(?:'|")?\\)/g;
+            const collect = (text, base) => {
+                if (!text || text === 'none') return;
+                re.lastIndex = 0;
+                let m;
+                while ((m = re.exec(text)) !== null) {
+                    try {
+                        urls.add(new URL(m[1], base).href);
+                    } catch(e){}
+                }
+            };
+            const walkRules = (rules, base) => {
+                for (const rule of rules) {
+                    if (rule.style) {
+                        collect(rule.style.getPropertyValue('background-image'), base);
+                        collect(rule.style.getPropertyValue('background'), base);
+                    }
+                    // @media, @supports, ... contiennent des règles imbriquées
+                    if (rule.cssRules) walkRules(rule.cssRules, base);
+                    // @import : feuille importée
+                    if (rule.styleSheet) walkSheet(rule.styleSheet);
+                }
+            };
+            const unreadable = [];
+            const walkSheet = (sheet) => {
+                let rules;
+                try {
+                    rules = sheet.cssRules;
+                } catch(e) {
+                    // feuille cross-origin (CDN) non lisible : traitée côté Python via CDP
+                    if (sheet.href) unreadable.push(sheet.href);
+                    return;
+                }
+                if (rules) walkRules(rules, sheet.href || document.baseURI);
+            };
+            for (const sheet of document.styleSheets) walkSheet(sheet);
+            for (const el of document.querySelectorAll('[style*=background]')) {
+                collect(el.style.getPropertyValue('background-image'), document.baseURI);
+            }
+            return {images: images, bgUrls: Array.from(urls), unreadableSheets: unreadable};
+        }"""
+    )
+
+def _collect_computed_bg_urls(page) -> List[str]:
+    """
+    Dernier recours sans CDP : background-image calculé de chaque élément du DOM.
+    """
+    return page.evaluate(
+        """() => {
+            const urls = new Set();
+            const re = /url\\((?:'|")?(.*?)(?:'|")?\\)/g;
+            for (const el of document.getElementsByTagName('*')) {
+                try {
+                    const s = getComputedStyle(el).getPropertyValue('background-image');
+                    if (!s || s === 'none') continue;
+                    re.lastIndex = 0;
+                    let m;
+                    while ((m = re.exec(s)) !== null) {
                         try {
-                            const s = getComputedStyle(el).getPropertyValue('background-image');
-                            if (!s || s === 'none') continue;
-                            // match all url(...) occurrences
-                            const re = /url\\((?:'|")?(.*?)(?:'|")?\\)/g;
-                            let m;
-                            while ((m = re.exec(s)) !== null) {
-                                try {
-                                    urls.add(new URL(m[1], location.href).href);
-                                } catch(e){}
-                            }
+                            urls.add(new URL(m[1], document.baseURI).href);
                         } catch(e){}
                     }
-                    return Array.from(urls);
-                }"""
-            )
-        except Exception:
-            bg_urls = []
+                } catch(e){}
+            }
+            return Array.from(urls);
+        }"""
+    )
 
-        used = dom_abs.union(set(bg_urls))
-        dead = sorted(list(net_images - used))
+def _track_stylesheets(cdp) -> Dict[str, List[str]]:
+    """
+    Enregistre les feuilles annoncées par CSS.styleSheetAdded : sourceURL -> [styleSheetId].
+    A appeler avant CSS.enable (qui ré-annonce les feuilles déjà présentes).
+    """
+    sheets = defaultdict(list)
 
-        # include DOM zero-size images that were requested but not already in dead
-        for z in sorted(zero_dom):
-            if z not in dead and z in net_images:
-                dead.append(z)
+    def on_sheet_added(params):
+        header = params.get("header") or {}
+        if header.get("sourceURL") and header.get("styleSheetId"):
+            sheets[header["sourceURL"]].append(header["styleSheetId"])
 
-        return dead
+    try:
+        cdp.on("CSS.styleSheetAdded", on_sheet_added)
     except Exception:
-        return []
+        pass
+    return sheets
+
+def _unreadable_sheets_bg_urls(cdp, sheets: Dict[str, List[str]], hrefs: List[str]) -> List[str]:
+    """
+    url(...) référencées par les feuilles cross-origin illisibles depuis la page :
+    leur texte est lu via CSS.getStyleSheetText, résolu par rapport au href de la feuille.
+    """
+    urls = []
+    for href in dict.fromkeys(hrefs):
+        for sid in sheets.get(href, ()):
+            try:
+                txt = cdp.send("CSS.getStyleSheetText", {"styleSheetId": sid}).get("text", "") or ""
+            except Exception:
+                continue
+            for token in _CSS_URL_RE.findall(txt):
+                urls.append(urljoin(href, token.strip()))
+    return urls
 
 def _start_cdp_coverage(cdp) -> None:
     try:
@@ -80,6 +188,84 @@ def _start_cdp_coverage(cdp) -> None:
     except Exception:
         pass
 
+def _content_length(headers: Dict[str, Any]) -> Optional[int]:
+    for k, v in (headers or {}).items():
+        if k.lower() == "content-length" and str(v).isdigit():
+            return int(v)
+    return None
+
+def _start_cdp_network(cdp, network_events: List[Dict[str, Any]]) -> bool:
+    """
+    Collecte les réponses réseau via les événements CDP, sans lire aucun body.
+    body_size = octets du body transférés (encodedDataLength de Network.loadingFinished
+    moins les en-têtes déjà comptés dans Network.responseReceived), comme le
+    Content-Length du chemin Playwright ; decoded_size = somme des dataLength de
+    Network.dataReceived. Comme Playwright, les redirections sont comptées et les
+    requêtes de preflight CORS ignorées.
+    Retourne False si le domaine Network n'a pas pu être activé.
+    """
+    events_by_id = {}
+    header_bytes = {}
+
+    def on_request_will_be_sent(params):
+        # une redirection n'a pas de responseReceived : elle arrive avec la requête suivante
+        redirect = params.get("redirectResponse")
+        if not redirect:
+            return
+        try:
+            network_events.append({
+                "url": redirect.get("url"),
+                "status": redirect.get("status"),
+                "resource_type": (params.get("type") or "other").lower(),
+                "content_type": redirect.get("mimeType"),
+                "body_size": _content_length(redirect.get("headers")),
+            })
+        except Exception:
+            pass
+
+    def on_response_received(params):
+        try:
+            if params.get("type") == "Preflight":
+                return
+            resp = params["response"]
+            entry = {
+                "url": resp.get("url"),
+                "status": resp.get("status"),
+                # "Stylesheet" (CDP) -> "stylesheet" (Playwright)
+                "resource_type": (params.get("type") or "other").lower(),
+                "content_type": resp.get("mimeType"),
+                "body_size": None,
+                "decoded_size": 0,
+            }
+            events_by_id[params["requestId"]] = entry
+            header_bytes[params["requestId"]] = int(resp.get("encodedDataLength") or 0)
+            network_events.append(entry)
+        except Exception:
+            pass
+
+    def on_data_received(params):
+        # dataLength = octets décodés (sans en-têtes ni compression)
+        entry = events_by_id.get(params.get("requestId"))
+        if entry is not None:
+            entry["decoded_size"] += int(params.get("dataLength") or 0)
+
+    def on_loading_finished(params):
+        request_id = params.get("requestId")
+        entry = events_by_id.get(request_id)
+        if entry is not None:
+            total = int(params.get("encodedDataLength") or 0)
+            entry["body_size"] = max(0, total - header_bytes.get(request_id, 0))
+
+    try:
+        cdp.on("Network.requestWillBeSent", on_request_will_be_sent)
+        cdp.on("Network.responseReceived", on_response_received)
+        cdp.on("Network.dataReceived", on_data_received)
+        cdp.on("Network.loadingFinished", on_loading_finished)
+        cdp.send("Network.enable")
+        return True
+    except Exception:
+        return False
+
 def _stop_and_get_dead_files(cdp, network_events: List[Dict[str, Any]], unused_threshold: float = 0.7) -> List[str]:
     """
     Retourne une liste d'URLs de fichiers (JS/CSS) chargés mais majoritairement inutilisés.
@@ -121,36 +307,51 @@ def _stop_and_get_dead_files(cdp, network_events: List[Dict[str, Any]], unused_t
             css_cov = None
 
         if css_cov and "ruleUsage" in css_cov:
-            # aggregate by styleSheetId
-            css_map = {}
+            # aggregate by styleSheetId : [total, used]
+            css_map = defaultdict(lambda: [0, 0])
             for ru in css_cov.get("ruleUsage", []):
-                sid = ru.get("styleSheetId")
-                used = bool(ru.get("used", False))
-                start = ru.get("startOffset", 0)
-                end = ru.get("endOffset", 0)
-                length = max(0, end - start)
-                if sid not in css_map:
-                    css_map[sid] = {"total_ranges": 0, "used_ranges": 0}
-                css_map[sid]["total_ranges"] += length
-                if used:
-                    css_map[sid]["used_ranges"] += length
+                length = max(0, ru.get("endOffset", 0) - ru.get("startOffset", 0))
+                v = css_map[ru.get("styleSheetId")]
+                v[0] += length
+                if ru.get("used", False):
+                    v[1] += length
+
+            # index des fichiers .css chargés : par tranche de taille et par nom de fichier
+            css_events_by_bucket = defaultdict(list)
+            css_events_by_name = {}
+            for ne in network_events:
+                ne_url = ne.get("url") or ""
+                if not ne_url.endswith(".css"):
+                    continue
+                # comparée au texte décodé de la feuille : taille décodée si connue
+                size = ne.get("decoded_size") or ne.get("body_size")
+                if size:
+                    css_events_by_bucket[size // _CSS_SIZE_TOLERANCE].append((size, ne_url))
+                css_events_by_name.setdefault(ne_url.rsplit("/", 1)[-1], ne_url)
 
             for sid, vals in css_map.items():
                 try:
                     txt = cdp.send("CSS.getStyleSheetText", {"styleSheetId": sid}).get("text", "") or ""
                     total_real = len(txt.encode("utf-8"))
-                    used_bytes = vals.get("used_ranges", 0)
+                    used_bytes = vals[1]
                     unused_pct = 1.0 - (used_bytes / total_real) if total_real > 0 else 0.0
 
-                    # heuristique pour retrouver l'URL : rechercher fichier .css dans les network_events contenu dans le texte
+                    # heuristique pour retrouver l'URL : taille à moins de _CSS_SIZE_TOLERANCE octets
+                    # (tranches voisines uniquement), sinon nom de fichier .css cité dans le texte
                     url_guess = None
-                    for ne in network_events:
-                        ne_url = ne.get("url")
-                        if not ne_url:
-                            continue
-                        if ne_url.endswith(".css") and (ne_url.split("/")[-1] in txt or abs((ne.get("body_size") or 0) - total_real) < 20):
-                            url_guess = ne_url
+                    bucket = total_real // _CSS_SIZE_TOLERANCE
+                    for b in (bucket, bucket - 1, bucket + 1):
+                        for size, ne_url in css_events_by_bucket.get(b, ()):
+                            if abs(size - total_real) < _CSS_SIZE_TOLERANCE:
+                                url_guess = ne_url
+                                break
+                        if url_guess:
                             break
+                    if url_guess is None and css_events_by_name:
+                        for name in _CSS_NAME_RE.findall(txt):
+                            url_guess = css_events_by_name.get(name)
+                            if url_guess:
+                                break
 
                     if url_guess and unused_pct >= unused_threshold:
                         dead.append(url_guess)
@@ -198,33 +399,42 @@ def run_analysis(url: str, timeout: int = 30) -> Dict[str, Any]:
 
             def on_response(response):
                 try:
+                    headers = response.headers
                     entry = {
                         "url": response.url,
                         "status": response.status,
                         "resource_type": response.request.resource_type,
-                        "headers": dict(response.headers),
+                        "content_type": headers.get("content-type"),
                     }
 
-                    # Taille du body si possible
-                    try:
-                        body = response.body()
-                        entry["body_size"] = len(body)
-                    except:
-                        entry["body_size"] = None
+                    # Taille : Content-Length si présent, sinon (chunked) on lit le body
+                    content_length = headers.get("content-length")
+                    if content_length and content_length.isdigit():
+                        entry["body_size"] = int(content_length)
+                    else:
+                        try:
+                            entry["body_size"] = entry["decoded_size"] = len(response.body())
+                        except:
+                            entry["body_size"] = None
 
                     network_events.append(entry)
                 except:
                     pass
 
-            page.on("response", on_response)
-# start CDP coverage if possible (to detect unused files)
+            # start CDP coverage if possible (to detect unused files)
             cdp = None
+            sheets = {}
             try:
                 cdp = context.new_cdp_session(page)
+                sheets = _track_stylesheets(cdp)
                 _start_cdp_coverage(cdp)
             except Exception:
                 cdp = None
 
+            # tailles réseau via CDP ; sinon via les réponses Playwright (Content-Length)
+            if not (cdp and _start_cdp_network(cdp, network_events)):
+                page.on("response", on_response)
+
             page.goto(url, wait_until="networkidle", timeout=timeout * 1000)
             page.wait_for_timeout(1000)
 
@@ -237,32 +447,31 @@ def run_analysis(url: str, timeout: int = 30) -> Dict[str, Any]:
                     dead_files = []
             report["dead_files"] = dead_files
 
-            # Collecter les images du DOM
-            dom_images = page.query_selector_all("img")
-            images = []
+            # Collecter images du DOM + background-images CSS en un seul evaluate
             base_url = page.url or url
-            for img in dom_images:
+            try:
+                dom_assets = _collect_dom_assets(page)
+            except Exception:
+                dom_assets = {}
+            images = dom_assets.get("images") or []
+            bg_urls = dom_assets.get("bgUrls") or []
+            unreadable = dom_assets.get("unreadableSheets") or []
+            if unreadable:
+                # feuilles cross-origin : texte lu via CDP, sinon style calculé de chaque élément
                 try:
-                    src = img.get_attribute("src")
-                    abs_src = urljoin(base_url, src) if src else None
-                    dims = page.evaluate(
-                        "(el) => ({w: el.naturalWidth, h: el.naturalHeight})", img
-                    )
-                    images.append({
-                        "src": src,
-                        "absolute_src": abs_src,
-                        "width": dims.get("w"),
-                        "height": dims.get("h"),
-                    })
-                except:
-                    images.append({"src": None, "absolute_src": None})
+                    if cdp:
+                        bg_urls += _unreadable_sheets_bg_urls(cdp, sheets, unreadable)
+                    else:
+                        bg_urls += _collect_computed_bg_urls(page)
+                except Exception:
+                    pass
 
             # Résumé
             total_transfer = 0
             reqs_out = []
 
             for r in network_events:
-                size = r.get("body_size") or int(r["headers"].get("content-length", 0))
+                size = r.get("body_size") or 0
                 total_transfer += size
 
                 reqs_out.append({
@@ -283,7 +492,7 @@ def run_analysis(url: str, timeout: int = 30) -> Dict[str, Any]:
                 if r["resource_type"] in ("stylesheet", "script")
             ]
 
-            dead_images = _detect_unused_images(page, network_events, images, base_url)
+            dead_images = _detect_unused_images(network_events, images, bg_urls, base_url)
             report["dead_images"] = dead_images
             # add summary count
             report["summary"]
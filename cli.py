@@ -1,8 +1,20 @@
 import argparse
 import json
+try:
+    import orjson
+except ImportError:
+    orjson = None
 from analysis import run_analysis
 from optimize import run_optimization
 
+def _write_report(report, path):
+    if orjson is not None:
+        with open(path, "wb") as f:
+            f.write(orjson.dumps(report, option=orjson.OPT_INDENT_2))
+    else:
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+
 def main():
     parser = argparse.ArgumentParser(description="Green Optimizer - Module Analyse")
     parser.add_argument("command", choices=["analyze","optimize"], help="Commande à exécuter")
@@ -12,13 +24,11 @@ def main():
 
     if args.command == "analyze":
         report = run_analysis(args.url)
-        with open(args.output, "w", encoding="utf-8") as f:
-            json.dump(report, f, indent=2, ensure_ascii=False)
+        _write_report(report, args.output)
         print(f"✔ Rapport généré : {args.output}")
     elif args.command == "optimize":
         report = run_optimization(args.url)
-        with open(args.output, "w", encoding="utf-8") as f:
-            json.dump(report, f, indent=2, ensure_ascii=False)
+        _write_report(report, args.output)
         print(f"✔ Rapport généré : {args.output}")
 
 if __name__ == "__main__":
@@ -1,14 +1,103 @@
-from selenium import webdriver
-from selenium.webdriver.common.by import By
-from selenium.webdriver.common.keys import Keys
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
+import atexit
+import functools
+import threading
+from urllib.parse import urlsplit, urlunsplit
 
+import requests
 
-def get_encode_score(url_test):
 
+ECOINDEX_API_URL = "https://bff.ecoindex.fr/api/v1/ecoindexes"
+
+# navigateur partagé entre les appels : évite un lancement de Chrome (~2s) par score
+_driver = None
+_driver_lock = threading.Lock()
+
+
+def _get_driver():
+    global _driver
+    if _driver is None:
+        from selenium import webdriver
+        _driver = webdriver.Chrome()
+    return _driver
+
+
+def _reset_driver():
+    global _driver
+    if _driver is not None:
+        try:
+            _driver.quit()
+        except Exception:
+            pass
+    _driver = None
+
+
+# ne pas laisser de chromedriver/Chrome orphelin à la sortie du process
+atexit.register(_reset_driver)
+
+
+def _normalize_url(url):
+    """
+    Forme comparable d'une URL : schéma/host en minuscules, sans fragment ni "/" final.
+    """
+    parts = urlsplit(url.strip())
+    path = parts.path.rstrip("/")
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), path, parts.query, ""))
+
+
+def _to_score(value):
+    """
+    Score sur 100 arrondi à l'entier, quelle que soit la source (float de l'API,
+    texte de la page ecoindex.fr) ; None si la valeur n'est pas un nombre.
+    """
+    try:
+        return round(float(str(value).strip().replace(",", ".")))
+    except (TypeError, ValueError):
+        return None
+
+
+def _api_score(url_test):
+    """
+    Score EcoIndex via l'API HTTP (un seul appel, pas de navigateur).
+    Retourne None si l'API n'a pas de résultat pour cette URL précise.
+    """
+    host = urlsplit(url_test).netloc
+    resp = requests.get(ECOINDEX_API_URL, params={"host": host}, timeout=10)
+    resp.raise_for_status()
+    data = resp.json()
+    items = data.get("items", []) if isinstance(data, dict) else data
+    # seul le résultat de l'URL demandée compte (pas une autre page du même host)
+    wanted = _normalize_url(url_test)
+    for item in items or []:
+        if item.get("url") and _normalize_url(item["url"]) == wanted:
+            return _to_score(item.get("score"))
+    return None
+
+
+@functools.lru_cache(maxsize=512)
+def get_encode_score(url_test, fallback=True):
+    try:
+        score = _api_score(url_test)
+    except Exception:
+        score = None
+    if score is not None or not fallback:
+        return score
+
+    # site non couvert par l'API : scraping de ecoindex.fr avec Selenium
+    with _driver_lock:
+        try:
+            return _scrape_score(_get_driver(), url_test)
+        except Exception:
+            # session Chrome possiblement cassée : on repartira d'un navigateur neuf
+            _reset_driver()
+            raise
+
+
+def _scrape_score(driver, url_test):
+    from selenium.webdriver.common.by import By
+    from selenium.webdriver.common.keys import Keys
+    from selenium.webdriver.support.ui import WebDriverWait
+    from selenium.webdriver.support import expected_conditions as EC
 
-    driver = webdriver.Chrome()
     wait = WebDriverWait(driver, 30)
 
     # 1. Aller sur EcoIndex
@@ -52,7 +141,4 @@ def get_encode_score(url_test):
         EC.presence_of_element_located((By.CSS_SELECTOR, "span[data-int='score']"))
     )
 
-    score = score_span.text
-
-    driver.quit()
-    return score
\ No newline at end of file
+    return _to_score(score_span.text)
\ No newline at end of file
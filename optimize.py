@@ -2,20 +2,73 @@
 Module d'optimisation automatique compatible Python 3.12+
 """
 
+import hashlib
+import io
 import json
 import os
 import shutil
+import threading
+from contextlib import nullcontext
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from PIL import Image
 from bs4 import BeautifulSoup
 import requests
+from requests.adapters import HTTPAdapter
 from urllib.parse import urljoin, urlparse
 
 from css_html_js_minify import html_minify, css_minify, js_minify
 
 
-def _download_file(url, dest):
+DOWNLOAD_WORKERS = 16
+
+# formats déjà modernes : pas de ré-encodage
+RESAMPLE_SKIP_FORMATS = {"WEBP", "AVIF"}
+# en dessous de cette taille, on ne produit que le WebP (l'encodeur AVIF est ~10x plus lent)
+SMALL_IMAGE_BYTES = 4096
+
+# CSS/JS déjà minifiés : le minifieur (pur Python) n'apporterait rien
+MINIFIED_SUFFIXES = (".min.css", ".min.js")
+MINIFIED_MAX_CHARS = 2048
+MINIFIED_MAX_LINES = 10
+
+
+def _make_session():
+    """
+    Session HTTP partagée ; avec requests-cache, les assets sont mis en cache disque
+    entre deux exécutions. Les en-têtes Cache-Control du serveur sont respectés
+    (24h par défaut sinon) et une entrée expirée est revalidée par requête
+    conditionnelle (ETag / Last-Modified) plutôt que re-téléchargée.
+    """
+    try:
+        import requests_cache
+    except ImportError:
+        return requests.Session()
+    return requests_cache.CachedSession(
+        cache_name=".green_cache", backend="sqlite", expire_after=86400, cache_control=True
+    )
+
+
+# session partagée (keep-alive) : une seule poignée de main TCP+TLS par host.
+# Créée au premier usage, pour que l'import du module (cli analyze, workers du
+# ProcessPoolExecutor) ne crée pas le cache .green_cache.sqlite.
+_SESSION = None
+_SESSION_LOCK = threading.Lock()
+
+
+def _get_session():
+    global _SESSION
+    with _SESSION_LOCK:
+        if _SESSION is None:
+            session = _make_session()
+            session.mount("http://", HTTPAdapter(pool_connections=16, pool_maxsize=32))
+            session.mount("https://", HTTPAdapter(pool_connections=16, pool_maxsize=32))
+            _SESSION = session
+        return _SESSION
+
+
+def _download_file(url, dest, session=None):
     try:
-        r = requests.get(url, timeout=10, stream=True)
+        r = (session or _get_session()).get(url, timeout=10, stream=True)
         if r.status_code == 200:
             with open(dest, "wb") as f:
                 for chunk in r.iter_content(8192):
@@ -26,14 +79,91 @@ def _download_file(url, dest):
         return False
 
 
+def _download_bytes(url, session=None):
+    """
+    Télécharge une ressource en mémoire ; retourne None en cas d'échec
+    """
+    try:
+        r = (session or _get_session()).get(url, timeout=10)
+        if r.status_code == 200:
+            return r.content
+        return None
+    except:
+        return None
+
+
 def _ensure_dir(path):
     if not os.path.exists(path):
         os.makedirs(path)
 
 
-def run_optimization(analysis_report: dict, output_dir="optimized/"):
+def _looks_minified(filename, content):
+    if filename.endswith(MINIFIED_SUFFIXES):
+        return True
+    return len(content) < MINIFIED_MAX_CHARS and content.count("\n") < MINIFIED_MAX_LINES
+
+
+def _unique_filename(url, taken):
+    """
+    Nom de fichier local pour url : le basename, préfixé d'un hash court de l'URL
+    s'il est déjà pris (téléchargements parallèles -> pas d'écriture concurrente).
+    Retourne None si l'URL n'a pas de nom de fichier.
+    """
+    filename = os.path.basename(urlparse(url).path)
+    if not filename:
+        return None
+    if filename in taken:
+        filename = hashlib.sha1(url.encode("utf-8")).hexdigest()[:8] + "_" + filename
+    taken.add(filename)
+    return filename
+
+
+def _download_all(downloads, session=None):
+    """
+    Télécharge en parallèle une liste de tuples (url, dest, ...) ; retourne les tuples téléchargés avec succès
+    """
+    if not downloads:
+        return []
+    with ThreadPoolExecutor(max_workers=DOWNLOAD_WORKERS) as ex:
+        ok = list(ex.map(lambda d: _download_file(d[0], d[1], session), downloads))
+    return [d for d, success in zip(downloads, ok) if success]
+
+
+def _encode_one(task):
+    """
+    Encode une image en WebP + AVIF (exécuté dans un process worker).
+    Les images déjà en WebP/AVIF sont ignorées, les petites n'ont que le WebP.
+    task = (data, webp_path, avif_path) avec data les octets de l'image d'origine
+    """
+    data, webp_path, avif_path = task
+    try:
+        im = Image.open(io.BytesIO(data))
+        if im.format in RESAMPLE_SKIP_FORMATS:
+            return {"skipped": f"already_{im.format.lower()}"}
+
+        original_size = len(data)
+        im = im.convert("RGB")
+
+        im.save(webp_path, "webp", quality=80)
+        entry = {
+            "webp": webp_path,
+            "gain_webp": original_size - os.path.getsize(webp_path),
+        }
+
+        if original_size >= SMALL_IMAGE_BYTES:
+            im.save(avif_path, "avif", quality=35)
+            entry["avif"] = avif_path
+            entry["gain_avif"] = original_size - os.path.getsize(avif_path)
+
+        return entry
+    except Exception as e:
+        return {"error": str(e)}
+
+
+def run_optimization(analysis_report: dict, output_dir="optimized/", keep_originals=False):
     """
     Optimise images, CSS, JS, HTML avec compatibilité full Python 3.12+
+    Les images sont traitées en mémoire ; keep_originals=True écrit aussi l'original sur disque.
     """
     # Accept URL string or path to report JSON
     if isinstance(analysis_report, str):
@@ -66,7 +196,11 @@ def run_optimization(analysis_report: dict, output_dir="optimized/"):
     main_html_content = None
     if main_url:
         try:
-            resp = requests.get(main_url, timeout=15)
+            session = _get_session()
+            # le document lui-même n'est jamais servi depuis le cache (seulement les assets statiques)
+            no_cache = session.cache_disabled() if hasattr(session, "cache_disabled") else nullcontext()
+            with no_cache:
+                resp = session.get(main_url, timeout=15)
             if resp.status_code == 200:
                 main_html_content = resp.text
                 minified = html_minify(main_html_content)
@@ -104,74 +238,127 @@ def run_optimization(analysis_report: dict, output_dir="optimized/"):
     # ----------------------------------------------------------
     # 1) Optimisation images (WebP + AVIF)
     # ----------------------------------------------------------
+    downloads = []
+    seen = set()
+    taken = set()
     for img in analysis_report.get("images", []):
         src = img.get("src")
         if not src or src.startswith("data:"):
             continue
 
-        filename = os.path.basename(urlparse(src).path)
-        if not filename:
+        # même image présente plusieurs fois dans la page : un seul téléchargement.
+        # L'URL absolue (résolue par le navigateur) sert de clé et d'URL à télécharger.
+        url = img.get("absolute_src") or src
+        if url in seen:
             continue
+        seen.add(url)
 
-        original_path = os.path.join(img_dir, filename)
-
-        if not _download_file(src, original_path):
+        filename = _unique_filename(url, taken)
+        if not filename:
             continue
 
-        try:
-            im = Image.open(original_path).convert("RGB")
-
-            webp_path = original_path + ".webp"
-            avif_path = original_path + ".avif"
+        downloads.append((url, os.path.join(img_dir, filename), src))
 
-            im.save(webp_path, "webp", quality=80)
-            im.save(avif_path, "avif", quality=35)
+    if downloads:
+        with ThreadPoolExecutor(max_workers=DOWNLOAD_WORKERS) as ex:
+            contents = list(ex.map(lambda d: _download_bytes(d[0]), downloads))
+    else:
+        contents = []
 
-            result["images"].append({
-                "src": src,
-                "original": original_path,
-                "webp": webp_path,
-                "avif": avif_path,
-                "gain_webp": os.path.getsize(original_path) - os.path.getsize(webp_path),
-                "gain_avif": os.path.getsize(original_path) - os.path.getsize(avif_path),
-            })
-        except Exception as e:
-            result["images"].append({"src": src, "error": str(e)})
+    # URLs différentes mais contenu identique : un seul encodage par contenu
+    hash_to_src = {}
+    unique = []
+    duplicates = []
+    for (_, original_path, src), data in zip(downloads, contents):
+        if data is None:
+            continue
+        if keep_originals:
+            with open(original_path, "wb") as f:
+                f.write(data)
+        kept = original_path if keep_originals else None
+        digest = hashlib.sha1(data).hexdigest()
+        if digest in hash_to_src:
+            duplicates.append({"src": src, "original": kept, "duplicate_of": hash_to_src[digest]})
+            continue
+        hash_to_src[digest] = src
+        unique.append((src, original_path, data))
+
+    # encodage CPU-bound : réparti sur tous les coeurs
+    tasks = [
+        (data, original_path + ".webp", original_path + ".avif")
+        for _, original_path, data in unique
+    ]
+    if len(tasks) == 1:
+        # une seule image : pas de process à démarrer
+        encoded_all = [_encode_one(tasks[0])]
+    elif tasks:
+        with ProcessPoolExecutor(max_workers=min(len(tasks), os.cpu_count() or 1)) as pool:
+            encoded_all = list(pool.map(_encode_one, tasks, chunksize=4))
+    else:
+        encoded_all = []
+    for (src, original_path, _), encoded in zip(unique, encoded_all):
+        result["images"].append({
+            "src": src,
+            "original": original_path if keep_originals else None,
+            **encoded,
+        })
+    result["images"].extend(duplicates)
 
     # ----------------------------------------------------------
     # 2) Minification CSS / JS
     # ----------------------------------------------------------
+    downloads = []
+    seen = set()
+    taken = set()
     for res in analysis_report.get("css_js", []):
         url = res.get("url")
         rtype = res.get("type")
 
-        filename = os.path.basename(urlparse(url).path)
+        if not url or url in seen:
+            continue
+        seen.add(url)
+
+        filename = _unique_filename(url, taken)
         if not filename:
             continue
 
         dest = os.path.join(css_dir if rtype == "stylesheet" else js_dir, filename)
+        downloads.append((url, dest, rtype))
 
-        if not _download_file(url, dest):
-            continue
-
+    for url, dest, rtype in _download_all(downloads):
+        # taille d'origine lue sur disque avant réécriture du fichier
+        original_size = os.path.getsize(dest)
         with open(dest, "r", encoding="utf-8", errors="ignore") as f:
             content = f.read()
 
+        if rtype not in ("stylesheet", "script"):
+            continue
+
+        if _looks_minified(os.path.basename(dest), content):
+            # fichier laissé tel quel sur disque
+            result["minified"].append({
+                "url": url,
+                "file": dest,
+                "original_size": original_size,
+                "optimized_size": original_size,
+                "skipped": "already_minified",
+            })
+            continue
+
         if rtype == "stylesheet":
             optimized = css_minify(content)
-        elif rtype == "script":
-            optimized = js_minify(content)
         else:
-            continue
+            optimized = js_minify(content)
 
-        with open(dest, "w", encoding="utf-8") as f:
-            f.write(optimized)
+        optimized_bytes = optimized.encode("utf-8")
+        with open(dest, "wb") as f:
+            f.write(optimized_bytes)
 
         result["minified"].append({
             "url": url,
             "file": dest,
-            "original_size": len(content.encode("utf-8")),
-            "optimized_size": len(optimized.encode("utf-8"))
+            "original_size": original_size,
+            "optimized_size": len(optimized_bytes)
         })
 
     # ----------------------------------------------------------
@@ -188,8 +375,10 @@ def run_optimization(analysis_report: dict, output_dir="optimized/"):
     )
 
     result["summary"] = {
-        "total_images_optimized": len(result["images"]),
-        "total_files_minified": len(result["minified"]),
+        "total_images_optimized": sum(1 for img in result["images"] if "webp" in img),
+        "total_images_skipped": sum(1 for img in result["images"] if img.get("skipped") or img.get("duplicate_of")),
+        "total_files_minified": sum(1 for m in result["minified"] if not m.get("skipped")),
+        "total_files_minify_skipped": sum(1 for m in result["minified"] if m.get("skipped")),
         "total_unused_removed": len(result["removed"]),
         "total_gain_bytes": total_gain
     }